@@ -2,6 +2,7 @@ from __future__ import annotations
 
 import os
 from datetime import datetime
+from functools import cached_property
 from typing import Annotated, Any, MutableMapping, TypeVar
 
 from pydantic import BaseModel as _BaseModel
@@ -98,15 +99,34 @@ class RegistryConfig(BaseModel):
     Users: MutableMapping[str, UserConfig]
     Groups: MutableMapping[str, GroupConfig]
 
-    def sub_from_preferred_username(self, preferred_username: str) -> str:
-        """Get the user sub from the preferred username.
+    # The lookup tables below are computed the first time they are used and
+    # never refreshed. They are meant for the read-only configs served to
+    # the services, not for configs which are being edited.
 
-        TODO: This could easily be cached or optimised
-        """
+    @cached_property
+    def subs_by_preferred_username(self) -> dict[str, str]:
+        """Mapping of the users' preferred usernames to their sub."""
+        subs: dict[str, str] = {}
         for sub, user in self.Users.items():
-            if user.PreferedUsername == preferred_username:
-                return sub
-        raise KeyError(f"User {preferred_username} not found in registry")
+            # Keep the first match, as the previous linear scan did
+            subs.setdefault(user.PreferedUsername, sub)
+        return subs
+
+    @cached_property
+    def properties_by_sub(self) -> dict[str, set[SecurityProperty]]:
+        """Mapping of the users' sub to the properties of all their groups."""
+        properties: dict[str, set[SecurityProperty]] = {}
+        for group in self.Groups.values():
+            for sub in group.Users:
+                properties.setdefault(sub, set()).update(group.Properties)
+        return properties
+
+    def sub_from_preferred_username(self, preferred_username: str) -> str:
+        """Get the user sub from the preferred username."""
+        try:
+            return self.subs_by_preferred_username[preferred_username]
+        except KeyError:
+            raise KeyError(f"User {preferred_username} not found in registry") from None
 
 
 class DIRACConfig(BaseModel):
@@ -179,3 +199,5 @@ class Config(BaseModel):
     _hexsha: str = PrivateAttr()
     # modification date
     _modified: datetime = PrivateAttr()
+    # modification date formatted as an HTTP date for the Last-Modified header
+    _modified_http: str = PrivateAttr()
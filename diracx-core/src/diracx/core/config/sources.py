@@ -10,6 +10,7 @@ import logging
 import os
 from abc import ABCMeta, abstractmethod
 from datetime import datetime, timezone
+from email.utils import format_datetime
 from pathlib import Path
 from tempfile import TemporaryDirectory
 from typing import Annotated
@@ -221,6 +222,7 @@ class BaseGitConfigSource(ConfigSource):
         config = config_class.model_validate(raw_obj)
         config._hexsha = hexsha
         config._modified = modified
+        config._modified_http = format_datetime(modified, usegmt=True)
         return config
 
     def extract_remote_url(self, backend_url: ConfigSourceUrl) -> str:
@@ -16,6 +16,7 @@ from collections.abc import AsyncIterator
 from pathlib import Path
 from typing import TYPE_CHECKING, Annotated, Any, Self, TypeVar
 
+import httpx
 from aiobotocore.session import get_session
 from authlib.jose import JsonWebKey
 from botocore.config import Config
@@ -30,6 +31,7 @@ from pydantic import (
     SecretStr,
     TypeAdapter,
     UrlConstraints,
+    model_validator,
 )
 from pydantic_settings import BaseSettings, SettingsConfigDict
 
@@ -138,7 +140,8 @@ class AuthSettings(ServiceSettingsBase):
 
     token_issuer: str
     token_key: TokenSigningKey
-    token_algorithm: str = "RS256"  # noqa: S105
+    # EdDSA (Ed25519) is much cheaper to sign and verify than RSA
+    token_algorithm: str = "EdDSA"  # noqa: S105
     access_token_expire_minutes: int = 20
     refresh_token_expire_minutes: int = 60
 
@@ -146,6 +149,50 @@ class AuthSettings(ServiceSettingsBase):
         default_factory=SecurityProperty.available_properties
     )
 
+    _http_client: httpx.AsyncClient | None = PrivateAttr(None)
+
+    @model_validator(mode="after")
+    def check_token_key_type(self) -> Self:
+        """Make sure the token key can be used with the token algorithm.
+
+        Otherwise the service would only fail when minting the first token.
+        """
+        if self.token_algorithm == "EdDSA":  # noqa: S105
+            expected_kty = "OKP"
+        elif self.token_algorithm.startswith(("RS", "PS")):
+            expected_kty = "RSA"
+        elif self.token_algorithm.startswith("ES"):
+            expected_kty = "EC"
+        else:
+            raise ValueError(f"Unsupported token algorithm {self.token_algorithm}")
+        if (kty := self.token_key.jwk.kty) != expected_kty:
+            raise ValueError(
+                f"The token key is of type {kty} but the token algorithm "
+                f"{self.token_algorithm} requires a {expected_kty} key, "
+                "set DIRACX_SERVICE_AUTH_TOKEN_ALGORITHM accordingly"
+            )
+        return self
+
+    @contextlib.asynccontextmanager
+    async def lifetime_function(self) -> AsyncIterator[None]:
+        # A single client is kept for the lifetime of the application so that
+        # the connections to the IdPs are pooled rather than re-established
+        # (including the TLS handshake) for every request
+        async with httpx.AsyncClient(
+            limits=httpx.Limits(
+                max_connections=100,
+                max_keepalive_connections=20,
+                keepalive_expiry=60,
+            )
+        ) as self._http_client:  # type: ignore
+            yield
+
+    @property
+    def http_client(self) -> httpx.AsyncClient:
+        if self._http_client is None:
+            raise RuntimeError("HTTP client accessed before lifetime function")
+        return self._http_client
+
 
 class SandboxStoreSettings(ServiceSettingsBase):
     """Settings for the sandbox store."""
@@ -0,0 +1,60 @@
+from __future__ import annotations
+
+import pytest
+
+from diracx.core.config.schema import RegistryConfig
+
+
+@pytest.fixture
+def registry():
+    return RegistryConfig.model_validate(
+        {
+            "DefaultGroup": "lhcb_user",
+            "IdP": {"URL": "https://idp-server.invalid", "ClientID": "test-idp"},
+            "Users": {
+                "sub-chaen": {"PreferedUsername": "chaen", "Email": None},
+                # Same preferred username as the user above
+                "sub-chaen2": {"PreferedUsername": "chaen", "Email": None},
+                "sub-albdr": {"PreferedUsername": "albdr", "Email": None},
+                "sub-nogroup": {"PreferedUsername": "nogroup", "Email": None},
+            },
+            "Groups": {
+                "lhcb_user": {
+                    "Properties": ["NormalUser", "PrivateLimitedDelegation"],
+                    "Users": ["sub-chaen", "sub-albdr"],
+                },
+                "lhcb_prmgr": {
+                    "Properties": ["NormalUser", "ProductionManagement"],
+                    "Users": ["sub-chaen"],
+                },
+            },
+        }
+    )
+
+
+def test_subs_by_preferred_username(registry):
+    # The first user with a given preferred username wins
+    assert registry.subs_by_preferred_username == {
+        "chaen": "sub-chaen",
+        "albdr": "sub-albdr",
+        "nogroup": "sub-nogroup",
+    }
+    assert registry.sub_from_preferred_username("chaen") == "sub-chaen"
+    with pytest.raises(KeyError, match="unknown"):
+        registry.sub_from_preferred_username("unknown")
+
+
+def test_properties_by_sub(registry):
+    # The properties of all the groups of a user are merged
+    assert registry.properties_by_sub["sub-chaen"] == {
+        "NormalUser",
+        "PrivateLimitedDelegation",
+        "ProductionManagement",
+    }
+    assert registry.properties_by_sub["sub-albdr"] == {
+        "NormalUser",
+        "PrivateLimitedDelegation",
+    }
+    # Users which are in no group have no entry
+    assert "sub-nogroup" not in registry.properties_by_sub
+    assert "sub-chaen2" not in registry.properties_by_sub
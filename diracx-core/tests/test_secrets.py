@@ -1,10 +1,13 @@
 from __future__ import annotations
 
+import pytest
+from cryptography.fernet import Fernet
 from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import rsa
 from cryptography.hazmat.primitives.asymmetric.ed25519 import Ed25519PrivateKey
-from pydantic import TypeAdapter
+from pydantic import TypeAdapter, ValidationError
 
-from diracx.core.settings import TokenSigningKey
+from diracx.core.settings import AuthSettings, TokenSigningKey
 
 
 def compare_keys(key1, key2):
@@ -45,3 +48,39 @@ def test_token_signing_key(tmp_path):
     compare_keys(
         adapter.validate_python(private_key_pem).jwk.get_private_key(), private_key
     )
+
+
+def _private_key_pem(private_key):
+    return private_key.private_bytes(
+        encoding=serialization.Encoding.PEM,
+        format=serialization.PrivateFormat.PKCS8,
+        encryption_algorithm=serialization.NoEncryption(),
+    ).decode("ascii")
+
+
+@pytest.mark.parametrize(
+    "token_algorithm, private_key, valid",
+    [
+        ("EdDSA", Ed25519PrivateKey.generate(), True),
+        ("RS256", rsa.generate_private_key(65537, 2048), True),
+        # The default algorithm with a key from before it changed
+        (None, rsa.generate_private_key(65537, 2048), False),
+        ("RS256", Ed25519PrivateKey.generate(), False),
+    ],
+)
+def test_token_algorithm_matches_key(token_algorithm, private_key, valid):
+    kwargs = {
+        "token_issuer": "https://diracx.invalid",
+        "token_key": _private_key_pem(private_key),
+        "state_key": Fernet.generate_key().decode(),
+    }
+    if token_algorithm is not None:
+        kwargs["token_algorithm"] = token_algorithm
+
+    if valid:
+        AuthSettings(**kwargs)
+    else:
+        with pytest.raises(
+            ValidationError, match="DIRACX_SERVICE_AUTH_TOKEN_ALGORITHM"
+        ):
+            AuthSettings(**kwargs)
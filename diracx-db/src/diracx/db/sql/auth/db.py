@@ -1,6 +1,7 @@
 from __future__ import annotations
 
 import secrets
+from datetime import datetime
 
 from sqlalchemy import insert, select, update
 from sqlalchemy.exc import IntegrityError, NoResultFound
@@ -200,9 +201,12 @@ class AuthDB(BaseSQLDB):
         jti: UUID,
         subject: str,
         scope: str,
+        creation_time: datetime | None = None,
     ) -> None:
         """Insert a refresh token in the DB as well as user attributes
         required to generate access tokens.
+
+        If creation_time is not given, the DB sets it to the current time.
         """
         # Insert values into the DB
         stmt = insert(RefreshTokens).values(
@@ -210,6 +214,8 @@ class AuthDB(BaseSQLDB):
             sub=subject,
             scope=scope,
         )
+        if creation_time is not None:
+            stmt = stmt.values(creation_time=creation_time)
         await self.conn.execute(stmt)
 
     async def get_refresh_token(self, jti: UUID) -> dict:
@@ -25,6 +25,13 @@ from .functions import date_trunc
 
 logger = logging.getLogger(__name__)
 
+# The pool is per DB and per worker, so the total number of connections
+# grows quickly: keep the SQLAlchemy defaults unless the deployment says so.
+DB_POOL_SIZE = int(os.environ.get("DIRACX_DB_POOL_SIZE", 5))
+DB_MAX_OVERFLOW = int(os.environ.get("DIRACX_DB_MAX_OVERFLOW", 10))
+# Log every SQL statement, only meant for debugging
+DB_ECHO = os.environ.get("DIRACX_DB_ECHO", "").lower() in ("1", "true", "yes")
+
 
 class SQLDBError(Exception):
     pass
@@ -175,7 +182,12 @@ class BaseSQLDB(metaclass=ABCMeta):
         # Set the pool_recycle to 30mn
         # That should prevent the problem of MySQL expiring connection
         # after 60mn by default
-        engine = create_async_engine(self._db_url, pool_recycle=60 * 30)
+        engine_kwargs: dict = {"pool_recycle": 60 * 30, "echo": DB_ECHO}
+        # SQLite uses a different pool class which doesn't take a size
+        if not self._db_url.startswith("sqlite"):
+            engine_kwargs["pool_size"] = DB_POOL_SIZE
+            engine_kwargs["max_overflow"] = DB_MAX_OVERFLOW
+        engine = create_async_engine(self._db_url, **engine_kwargs)
         self._engine = engine
         try:
             yield
@@ -1,5 +1,7 @@
 from __future__ import annotations
 
+from datetime import datetime, timezone
+
 import pytest
 from uuid_utils import UUID, uuid7
 
@@ -40,6 +42,22 @@ async def test_insert(auth_db: AuthDB):
     assert jti1 != jti2
 
 
+async def test_insert_with_creation_time(auth_db: AuthDB):
+    """Insert a refresh token with an explicit creation time and check it is stored."""
+    jti = uuid7()
+    creation_time = datetime.now(timezone.utc).replace(microsecond=0)
+    async with auth_db as auth_db:
+        await auth_db.insert_refresh_token(
+            jti,
+            "subject",
+            "vo:lhcb property:NormalUser",
+            creation_time=creation_time,
+        )
+        res = await auth_db.get_refresh_token(jti)
+
+    assert res["CreationTime"].replace(tzinfo=timezone.utc) == creation_time
+
+
 async def test_get(auth_db: AuthDB):
     """Insert a refresh token in the DB and get it."""
     # Refresh token details we want to insert
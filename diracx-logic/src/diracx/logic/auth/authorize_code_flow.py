@@ -3,6 +3,7 @@
 from __future__ import annotations
 
 from typing import Literal
+from urllib.parse import quote, urlencode
 
 from diracx.core.config import Config
 from diracx.core.models import GrantType
@@ -62,6 +63,7 @@ async def initiate_authorization_flow(
         f"{request_url}/complete",
         state_for_iam,
         settings.state_key.fernet,
+        settings.http_client,
     )
 
     return authorization_flow_url
@@ -87,6 +89,7 @@ async def complete_authorization_flow(
         code,
         decrypted_state,
         request_url,
+        settings.http_client,
     )
 
     # Store the ID token and redirect the user to the client's redirect URI
@@ -96,4 +99,7 @@ async def complete_authorization_flow(
         settings.authorization_flow_expiration_seconds,
     )
 
-    return f"{redirect_uri}?code={code}&state={decrypted_state['external_state']}"
+    query = urlencode(
+        {"code": code, "state": decrypted_state["external_state"]}, quote_via=quote
+    )
+    return f"{redirect_uri}?{query}"
@@ -70,6 +70,7 @@ async def do_device_flow(
         redirect_uri,
         state_for_iam,
         settings.state_key.fernet,
+        settings.http_client,
     )
     return authorization_flow_url
 
@@ -94,6 +95,7 @@ async def finish_device_flow(
         code,
         decrypted_state,
         request_url,
+        settings.http_client,
     )
     await auth_db.device_flow_insert_id_token(
         decrypted_state["user_code"], id_token, settings.device_flow_expiration_seconds
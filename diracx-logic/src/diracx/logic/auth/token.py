@@ -4,10 +4,10 @@ from __future__ import annotations
 
 import base64
 import hashlib
+import hmac
 import re
 from datetime import datetime, timedelta, timezone
 
-from authlib.jose import JsonWebToken
 from uuid_utils import UUID, uuid7
 
 from diracx.core.config import Config
@@ -30,7 +30,9 @@ from diracx.db.sql.auth.schema import FlowStatus, RefreshTokenStatus
 from diracx.db.sql.utils.functions import substract_date
 
 from .utils import (
+    compute_code_challenge,
     get_allowed_user_properties,
+    get_json_web_token,
     parse_and_validate_scope,
     verify_dirac_refresh_token,
 )
@@ -136,15 +138,12 @@ async def get_oidc_token_info_from_authorization_flow(
 
     # Check the code_verifier
     try:
-        code_challenge = (
-            base64.urlsafe_b64encode(hashlib.sha256(code_verifier.encode()).digest())
-            .decode()
-            .strip("=")
-        )
+        code_challenge = compute_code_challenge(code_verifier)
     except Exception as e:
         raise ValueError("Malformed code_verifier") from e
 
-    if code_challenge != info["CodeChallenge"]:
+    # Constant time comparison to avoid leaking the expected challenge
+    if not hmac.compare_digest(code_challenge.encode(), info["CodeChallenge"].encode()):
         raise ValueError("Invalid code_challenge")
 
     oidc_token_info = info["IDToken"]
@@ -292,10 +291,8 @@ async def exchange_token(
     if user_info := config.Registry[vo].Users.get(sub):
         preferred_username = user_info.PreferedUsername
     else:
-        preferred_username = oidc_token_info.get("preferred_username", sub)
-        raise NotImplementedError(
-            "Dynamic registration of users is not yet implemented"
-        )
+        # Dynamic registration of users is not yet implemented
+        raise InvalidCredentialsError(f"User is not registered in {vo}")
 
     # Check that the subject is part of the dirac users
     if sub not in config.Registry[vo].Groups[dirac_group].Users:
@@ -356,7 +353,7 @@ async def exchange_token(
 
 
 def create_token(payload: TokenPayload, settings: AuthSettings) -> str:
-    jwt = JsonWebToken(settings.token_algorithm)
+    jwt = get_json_web_token(settings.token_algorithm)
     encoded_jwt = jwt.encode(
         {"alg": settings.token_algorithm}, payload, settings.token_key.jwk
     )
@@ -371,17 +368,19 @@ async def insert_refresh_token(
     """Insert a refresh token into the database and return the JWT ID and creation time."""
     # Generate a JWT ID
     jti = uuid7()
+    # Set the creation time here rather than reading back the DB default,
+    # which saves a locking SELECT per token
+    creation_time = datetime.now(timezone.utc)
 
     # Insert the refresh token into the DB
     await auth_db.insert_refresh_token(
         jti=jti,
         subject=subject,
         scope=scope,
+        creation_time=creation_time,
     )
 
-    # Get the creation time of the refresh token
-    refresh_token = await auth_db.get_refresh_token(jti)
-    return jti, refresh_token["CreationTime"]
+    return jti, creation_time
 
 
 async def get_device_flow(auth_db: AuthDB, device_code: str, max_validity: int):
@@ -2,12 +2,17 @@ from __future__ import annotations
 
 import base64
 import hashlib
-import json
+import os
 import secrets
+from functools import lru_cache
+from urllib.parse import quote, urlencode
 
 import httpx
+import orjson
 from authlib.integrations.starlette_client import OAuthError
 from authlib.jose import JsonWebKey, JsonWebToken
+from authlib.jose.errors import DecodeError
+from authlib.jose.util import extract_header
 from authlib.oidc.core import IDToken
 from cachetools import TTLCache
 from cryptography.fernet import Fernet
@@ -27,83 +32,134 @@ class ScopeInfoDict(TypedDict):
     vo: str
 
 
-_server_metadata_cache: TTLCache = TTLCache(maxsize=1024, ttl=3600)
+SERVER_METADATA_CACHE_TTL = int(
+    os.environ.get("DIRACX_SERVER_METADATA_CACHE_TTL", 3600)
+)
+# IdPs rotate their signing keys on the time scale of days, so the imported
+# key sets can be kept for much longer than the server metadata
+JWKS_CACHE_TTL = int(os.environ.get("DIRACX_JWKS_CACHE_TTL", 24 * 3600))
 
+_server_metadata_cache: TTLCache = TTLCache(maxsize=1024, ttl=SERVER_METADATA_CACHE_TTL)
+_jwk_set_cache: TTLCache = TTLCache(maxsize=1024, ttl=JWKS_CACHE_TTL)
 
-async def get_server_metadata(url: str):
+
+async def get_server_metadata(url: str, http_client: httpx.AsyncClient):
     """Get the server metadata from the IAM."""
     server_metadata = _server_metadata_cache.get(url)
     if server_metadata is None:
-        async with httpx.AsyncClient() as c:
-            res = await c.get(url)
-            if res.status_code != 200:
-                # TODO: Better error handling
-                raise NotImplementedError(res)
-            server_metadata = res.json()
-            _server_metadata_cache[url] = server_metadata
+        res = await http_client.get(url)
+        if res.status_code != 200:
+            # TODO: Better error handling
+            raise NotImplementedError(res)
+        server_metadata = res.json()
+        _server_metadata_cache[url] = server_metadata
     return server_metadata
 
 
+def compute_code_challenge(code_verifier: str) -> str:
+    """Compute the S256 PKCE code_challenge of a code_verifier.
+
+    See https://www.rfc-editor.org/rfc/rfc7636#section-4.2
+    """
+    return (
+        base64.urlsafe_b64encode(hashlib.sha256(code_verifier.encode("ascii")).digest())
+        .rstrip(b"=")
+        .decode("ascii")
+    )
+
+
 def encrypt_state(state_dict: dict[str, str], cipher_suite: Fernet) -> str:
     """Encrypt the state dict and return it as a string."""
-    return cipher_suite.encrypt(
-        base64.urlsafe_b64encode(json.dumps(state_dict).encode())
-    ).decode()
+    # Fernet tokens are already urlsafe base64, no need for another layer
+    return cipher_suite.encrypt(orjson.dumps(state_dict)).decode()
 
 
 def decrypt_state(state: str, cipher_suite: Fernet) -> dict[str, str]:
     """Decrypt the state string and return it as a dict."""
     try:
-        return json.loads(
-            base64.urlsafe_b64decode(cipher_suite.decrypt(state.encode())).decode()
-        )
+        return orjson.loads(cipher_suite.decrypt(state.encode()))
     except Exception as e:
         raise AuthorizationError("Invalid state") from e
 
 
-async def fetch_jwk_set(url: str):
-    """Fetch the JWK set from the IAM."""
-    server_metadata = await get_server_metadata(url)
+async def fetch_jwk_set(
+    url: str, http_client: httpx.AsyncClient, *, refresh: bool = False
+):
+    """Fetch the JWK set from the IAM.
+
+    The imported key set is cached, use ``refresh`` to bypass the cache.
+    """
+    if not refresh and (jwk_set := _jwk_set_cache.get(url)) is not None:
+        return jwk_set
+
+    server_metadata = await get_server_metadata(url, http_client)
 
     jwks_uri = server_metadata.get("jwks_uri")
     if not jwks_uri:
         raise RuntimeError('Missing "jwks_uri" in metadata')
 
-    async with httpx.AsyncClient() as c:
-        res = await c.get(jwks_uri)
-        if res.status_code != 200:
-            # TODO: Better error handling
-            raise NotImplementedError(res)
-        jwk_set = res.json()
+    res = await http_client.get(jwks_uri)
+    if res.status_code != 200:
+        # TODO: Better error handling
+        raise NotImplementedError(res)
+    jwk_set = JsonWebKey.import_key_set(res.json())
 
-    return JsonWebKey.import_key_set(jwk_set)
+    _jwk_set_cache[url] = jwk_set
+    return jwk_set
 
 
-async def parse_id_token(config, vo, raw_id_token: str):
+async def parse_id_token(config, vo, raw_id_token: str, http_client: httpx.AsyncClient):
     """Parse and validate the ID token from IAM."""
     server_metadata = await get_server_metadata(
-        config.Registry[vo].IdP.server_metadata_url
+        config.Registry[vo].IdP.server_metadata_url, http_client
     )
     alg_values = server_metadata.get("id_token_signing_alg_values_supported", ["RS256"])
-    jwk_set = await fetch_jwk_set(config.Registry[vo].IdP.server_metadata_url)
-
-    token = JsonWebToken(alg_values).decode(
-        raw_id_token,
-        key=jwk_set,
-        claims_cls=IDToken,
-        claims_options={
-            "iss": {"values": [server_metadata["issuer"]]},
-            # The audience is a required parameter and is the client ID of the application
-            # https://openid.net/specs/openid-connect-core-1_0.html#IDToken
-            "aud": {"values": [config.Registry[vo].IdP.ClientID]},
-        },
+    jwk_set = await fetch_jwk_set(
+        config.Registry[vo].IdP.server_metadata_url, http_client
     )
+
+    jwt = JsonWebToken(alg_values)
+    claims_options = {
+        "iss": {"values": [server_metadata["issuer"]]},
+        # The audience is a required parameter and is the client ID of the application
+        # https://openid.net/specs/openid-connect-core-1_0.html#IDToken
+        "aud": {"values": [config.Registry[vo].IdP.ClientID]},
+    }
+    try:
+        token = jwt.decode(
+            raw_id_token,
+            key=jwk_set,
+            claims_cls=IDToken,
+            claims_options=claims_options,
+        )
+    except ValueError:
+        # If the key used to sign the token is not in the cached key set,
+        # the IdP may have rotated its keys, so fetch them again and retry
+        kid = extract_header(raw_id_token.split(".", 1)[0].encode(), DecodeError).get(
+            "kid"
+        )
+        if kid is None or any(key.kid == kid for key in jwk_set.keys):
+            raise
+        jwk_set = await fetch_jwk_set(
+            config.Registry[vo].IdP.server_metadata_url, http_client, refresh=True
+        )
+        token = jwt.decode(
+            raw_id_token,
+            key=jwk_set,
+            claims_cls=IDToken,
+            claims_options=claims_options,
+        )
     token.validate()
     return token
 
 
 async def initiate_authorization_flow_with_iam(
-    config, vo: str, redirect_uri: str, state: dict[str, str], cipher_suite: Fernet
+    config,
+    vo: str,
+    redirect_uri: str,
+    state: dict[str, str],
+    cipher_suite: Fernet,
+    http_client: httpx.AsyncClient,
 ):
     """Initiate the authorization flow with the IAM. Return the URL to redirect the user to.
 
@@ -111,17 +167,12 @@ async def initiate_authorization_flow_with_iam(
     It is then decrypted when the user is redirected back to the redirect_uri.
     """
     # code_verifier: https://www.rfc-editor.org/rfc/rfc7636#section-4.1
-    code_verifier = secrets.token_hex()
+    code_verifier = secrets.token_urlsafe()
 
-    # code_challenge: https://www.rfc-editor.org/rfc/rfc7636#section-4.2
-    code_challenge = (
-        base64.urlsafe_b64encode(hashlib.sha256(code_verifier.encode()).digest())
-        .decode()
-        .replace("=", "")
-    )
+    code_challenge = compute_code_challenge(code_verifier)
 
     server_metadata = await get_server_metadata(
-        config.Registry[vo].IdP.server_metadata_url
+        config.Registry[vo].IdP.server_metadata_url, http_client
     )
 
     # Take these two from CS/.well-known
@@ -133,25 +184,32 @@ async def initiate_authorization_flow_with_iam(
         state | {"vo": vo, "code_verifier": code_verifier}, cipher_suite
     )
 
-    url_params = [
-        "response_type=code",
-        f"code_challenge={code_challenge}",
-        "code_challenge_method=S256",
-        f"client_id={config.Registry[vo].IdP.ClientID}",
-        f"redirect_uri={redirect_uri}",
-        "scope=openid%20profile",
-        f"state={encrypted_state}",
-    ]
-    authorization_flow_url = f"{authorization_endpoint}?{'&'.join(url_params)}"
+    url_params = {
+        "response_type": "code",
+        "code_challenge": code_challenge,
+        "code_challenge_method": "S256",
+        "client_id": config.Registry[vo].IdP.ClientID,
+        "redirect_uri": redirect_uri,
+        "scope": "openid profile",
+        "state": encrypted_state,
+    }
+    authorization_flow_url = (
+        f"{authorization_endpoint}?{urlencode(url_params, quote_via=quote)}"
+    )
     return authorization_flow_url
 
 
 async def get_token_from_iam(
-    config, vo: str, code: str, state: dict[str, str], redirect_uri: str
+    config,
+    vo: str,
+    code: str,
+    state: dict[str, str],
+    redirect_uri: str,
+    http_client: httpx.AsyncClient,
 ) -> dict[str, str]:
     """Get the token from the IAM using the code and state. Return the ID token."""
     server_metadata = await get_server_metadata(
-        config.Registry[vo].IdP.server_metadata_url
+        config.Registry[vo].IdP.server_metadata_url, http_client
     )
 
     # Take these two from CS/.well-known
@@ -165,15 +223,14 @@ async def get_token_from_iam(
         "redirect_uri": redirect_uri,
     }
 
-    async with httpx.AsyncClient() as c:
-        res = await c.post(
-            token_endpoint,
-            data=data,
-        )
-        if res.status_code >= 500:
-            raise IAMServerError("Failed to contact IAM server")
-        elif res.status_code >= 400:
-            raise IAMClientError("Failed to contact IAM server")
+    res = await http_client.post(
+        token_endpoint,
+        data=data,
+    )
+    if res.status_code >= 500:
+        raise IAMServerError("Failed to contact IAM server")
+    elif res.status_code >= 400:
+        raise IAMClientError("Failed to contact IAM server")
 
     raw_id_token = res.json()["id_token"]
     # Extract the payload and verify it
@@ -182,6 +239,7 @@ async def get_token_from_iam(
             config=config,
             vo=vo,
             raw_id_token=raw_id_token,
+            http_client=http_client,
         )
     except OAuthError:
         raise
@@ -189,13 +247,23 @@ async def get_token_from_iam(
     return id_token
 
 
+@lru_cache(maxsize=8)
+def get_json_web_token(token_algorithm: str) -> JsonWebToken:
+    """Return a JsonWebToken for the given algorithm.
+
+    The instances are stateless so they are shared instead of rebuilding the
+    algorithm registry for every token.
+    """
+    return JsonWebToken(token_algorithm)
+
+
 def read_token(
     payload: str, token_algorithm: str, key: JsonWebKey, claims_options=None
 ) -> dict:
     # First transform it into bytes, then return a jwt object
     # Don't take settings as a parameter to allow claims_options to be None or something else
     encoded_payload = payload.encode("ascii")
-    jwt = JsonWebToken(token_algorithm)
+    jwt = get_json_web_token(token_algorithm)
     decoded_jwt = jwt.decode(encoded_payload, key, claims_options=claims_options)
     decoded_jwt.validate()
     return decoded_jwt
@@ -215,11 +283,8 @@ async def verify_dirac_refresh_token(
 
 def get_allowed_user_properties(config: Config, sub, vo: str) -> set[SecurityProperty]:
     """Retrieve all properties of groups a user is registered in."""
-    allowed_user_properties = set()
-    for group in config.Registry[vo].Groups:
-        if sub in config.Registry[vo].Groups[group].Users:
-            allowed_user_properties.update(config.Registry[vo].Groups[group].Properties)
-    return allowed_user_properties
+    # Return a copy as the callers are free to modify it
+    return set(config.Registry[vo].properties_by_sub.get(sub, ()))
 
 
 def parse_and_validate_scope(
@@ -237,17 +302,15 @@ def parse_and_validate_scope(
     """
     scopes = set(scope.split(" "))
 
-    groups = []
-    properties = []
-    vos = []
+    groups: list[str] = []
+    properties: list[str] = []
+    vos: list[str] = []
     unrecognised = []
+    scopes_by_kind = {"group": groups, "property": properties, "vo": vos}
     for scope in scopes:
-        if scope.startswith("group:"):
-            groups.append(scope.split(":", 1)[1])
-        elif scope.startswith("property:"):
-            properties.append(scope.split(":", 1)[1])
-        elif scope.startswith("vo:"):
-            vos.append(scope.split(":", 1)[1])
+        kind, sep, value = scope.partition(":")
+        if sep and kind in scopes_by_kind:
+            scopes_by_kind[kind].append(value)
         else:
             unrecognised.append(scope)
     if unrecognised:
@@ -277,15 +340,14 @@ def parse_and_validate_scope(
             raise ValueError(f"{group} not in {vo} groups")
 
     allowed_properties = config.Registry[vo].Groups[group].Properties
-    properties.extend([str(p) for p in allowed_properties])
+    requested_properties = set(properties)
+    requested_properties.update(str(p) for p in allowed_properties)
 
-    if not set(properties).issubset(available_properties):
-        raise ValueError(
-            f"{set(properties)-set(available_properties)} are not valid properties"
-        )
+    if invalid_properties := requested_properties.difference(available_properties):
+        raise ValueError(f"{invalid_properties} are not valid properties")
 
     return {
         "group": group,
-        "properties": set(sorted(properties)),
+        "properties": requested_properties,
         "vo": vo,
     }
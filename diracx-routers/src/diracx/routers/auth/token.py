@@ -2,6 +2,7 @@
 
 from __future__ import annotations
 
+import asyncio
 import os
 from typing import Annotated, Literal
 
@@ -18,6 +19,7 @@ from diracx.core.models import (
     AccessTokenPayload,
     GrantType,
     RefreshTokenPayload,
+    TokenPayload,
     TokenResponse,
 )
 from diracx.logic.auth.token import create_token
@@ -33,6 +35,17 @@ from ..fastapi_classes import DiracxRouter
 router = DiracxRouter(require_auth=False)
 
 
+async def _sign_token(payload: TokenPayload, settings: AuthSettings) -> str:
+    """Sign the token without blocking the event loop for too long.
+
+    RSA signatures take milliseconds so they are done in a thread, whereas
+    EdDSA ones are cheaper than the thread hop itself.
+    """
+    if settings.token_algorithm.startswith(("RS", "PS")):
+        return await asyncio.to_thread(create_token, payload, settings)
+    return create_token(payload, settings)
+
+
 async def mint_token(
     access_payload: AccessTokenPayload,
     refresh_payload: RefreshTokenPayload | None,
@@ -62,12 +75,12 @@ async def mint_token(
 
     # Create the access token
     access_payload["dirac_policies"] = dirac_access_policies
-    access_token = create_token(access_payload, settings)
+    access_token = await _sign_token(access_payload, settings)
 
     # Create the refresh token
     if refresh_payload:
         refresh_payload["dirac_policies"] = dirac_refresh_policies
-        refresh_token = create_token(refresh_payload, settings)
+        refresh_token = await _sign_token(refresh_payload, settings)
     elif existing_refresh_token:
         refresh_token = existing_refresh_token
 
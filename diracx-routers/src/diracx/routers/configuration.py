@@ -1,11 +1,11 @@
 from __future__ import annotations
 
-from datetime import datetime, timezone
+from datetime import timezone
+from email.utils import parsedate_to_datetime
 from typing import Annotated
 
 from fastapi import (
     Header,
-    HTTPException,
     Response,
     status,
 )
@@ -14,11 +14,44 @@ from .access_policies import open_access
 from .dependencies import Config
 from .fastapi_classes import DiracxRouter
 
-LAST_MODIFIED_FORMAT = "%a, %d %b %Y %H:%M:%S GMT"
+# Clients may reuse their copy of the config without asking again for that
+# many seconds. Configuration changes are not expected to be urgent.
+CONFIG_MAX_AGE = 30
 
 router = DiracxRouter()
 
 
+def _caching_headers(config: Config) -> dict[str, str]:
+    """Return the caching headers of the config."""
+    return {
+        "ETag": config._hexsha,
+        "Last-Modified": config._modified_http,
+        "Cache-Control": f"private, max-age={CONFIG_MAX_AGE}",
+    }
+
+
+def _is_not_modified(
+    config: Config, if_none_match: str | None, if_modified_since: str | None
+) -> bool:
+    """Whether the client already has the latest config."""
+    if if_none_match == config._hexsha:
+        return True
+
+    # This is to prevent flip/flopping in case
+    # a server gets out of sync with disk
+    if if_modified_since:
+        try:
+            not_before = parsedate_to_datetime(if_modified_since)
+        except (ValueError, OverflowError):
+            return False
+        # HTTP dates are always in GMT, even when the zone is missing
+        if not_before.tzinfo is None:
+            not_before = not_before.replace(tzinfo=timezone.utc)
+        return not_before > config._modified
+
+    return False
+
+
 @open_access
 @router.get("/")
 async def serve_config(
@@ -36,29 +69,29 @@ async def serve_config(
         return 304: this is to avoid flip/flopping
     """
     # await check_permissions()
-    headers = {
-        "ETag": config._hexsha,
-        "Last-Modified": config._modified.strftime(LAST_MODIFIED_FORMAT),
-    }
-
-    if if_none_match == config._hexsha:
-        raise HTTPException(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
-
-    # This is to prevent flip/flopping in case
-    # a server gets out of sync with disk
-    if if_modified_since:
-        try:
-            not_before = datetime.strptime(
-                if_modified_since, LAST_MODIFIED_FORMAT
-            ).astimezone(timezone.utc)
-        except ValueError:
-            pass
-        else:
-            if not_before > config._modified:
-                raise HTTPException(
-                    status_code=status.HTTP_304_NOT_MODIFIED, headers=headers
-                )
+    headers = _caching_headers(config)
+    if _is_not_modified(config, if_none_match, if_modified_since):
+        # Skip the serialization of the config altogether
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
 
     response.headers.update(headers)
 
     return config
+
+
+@open_access
+@router.head("/", include_in_schema=False)
+async def serve_config_headers(
+    config: Config,
+    if_none_match: Annotated[str | None, Header()] = None,
+    if_modified_since: Annotated[str | None, Header()] = None,
+) -> Response:
+    """Get the ETag and Last-Modified of the latest config without its content."""
+    headers = _caching_headers(config)
+    if _is_not_modified(config, if_none_match, if_modified_since):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+    response = Response(headers=headers, media_type="application/json")
+    # The length of the config isn't known without serializing it, and
+    # advertising an empty body would contradict the GET response
+    del response.headers["content-length"]
+    return response
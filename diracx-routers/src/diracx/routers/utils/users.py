@@ -1,10 +1,13 @@
 from __future__ import annotations
 
-import re
+import hashlib
+import os
+import time
 import uuid as std_uuid
 from typing import Annotated, Any
 
 from authlib.jose import JoseError
+from cachetools import TLRUCache
 from fastapi import Depends, HTTPException, status
 from fastapi.security import OpenIdConnect
 from pydantic import BaseModel, GetCoreSchemaHandler, GetJsonSchemaHandler
@@ -67,6 +70,27 @@ class AuthorizedUserInfo(AuthInfo, UserInfo):
     pass
 
 
+# Verifying the signature of the access token is the most expensive part of
+# handling a request. As the same token is presented many times before it
+# expires, the resulting AuthorizedUserInfo is kept in memory for a short time,
+# keyed by the SHA-256 of the raw token. Only tokens which passed validation are
+# cached and entries never outlive the expiration of the token itself.
+# Each request gets its own copy of the cached AuthorizedUserInfo so that
+# modifying it can't leak into the requests of other users.
+TOKEN_CACHE_TTL = int(os.environ.get("DIRACX_TOKEN_CACHE_TTL", 30))
+TOKEN_CACHE_MAXSIZE = int(os.environ.get("DIRACX_TOKEN_CACHE_MAXSIZE", 10_000))
+
+
+def _token_cache_ttu(key, value: tuple[AuthorizedUserInfo, float], now: float):
+    """Expire the cache entries at the latest when the token expires."""
+    return min(now + TOKEN_CACHE_TTL, value[1])
+
+
+_token_cache: TLRUCache = TLRUCache(
+    maxsize=TOKEN_CACHE_MAXSIZE, ttu=_token_cache_ttu, timer=time.time
+)
+
+
 async def verify_dirac_access_token(
     authorization: Annotated[str, Depends(oidc_scheme)],
     settings: AuthSettings,
@@ -80,14 +104,20 @@ async def verify_dirac_access_token(
             detail="Authorization header is missing",
             headers={"WWW-Authenticate": "Bearer"},
         )
-    if match := re.fullmatch(r"Bearer (.+)", authorization):
-        raw_token = match.group(1)
-    else:
+    if not authorization.startswith("Bearer ") or not (
+        raw_token := authorization[len("Bearer ") :]
+    ):
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail="Invalid authorization header",
         )
 
+    cache_key = hashlib.sha256(raw_token.encode()).digest()
+    if cached := _token_cache.get(cache_key):
+        user_info, exp = cached
+        if exp > time.time():
+            return user_info.model_copy(deep=True)
+
     try:
         token = read_token(
             raw_token,
@@ -103,7 +133,7 @@ async def verify_dirac_access_token(
             detail="Invalid JWT",
         ) from None
 
-    return AuthorizedUserInfo(
+    user_info = AuthorizedUserInfo(
         bearer_token=raw_token,
         token_id=token["jti"],
         properties=token["dirac_properties"],
@@ -113,3 +143,9 @@ async def verify_dirac_access_token(
         vo=token["vo"],
         policies=token.get("dirac_policies", {}),
     )
+    if TOKEN_CACHE_TTL > 0 and "exp" in token:
+        _token_cache[cache_key] = (
+            user_info.model_copy(deep=True),
+            float(token["exp"]),
+        )
+    return user_info
@@ -3,6 +3,7 @@ from __future__ import annotations
 import base64
 import hashlib
 import secrets
+import time
 from datetime import datetime, timedelta, timezone
 from pathlib import Path
 from urllib.parse import parse_qs, urlparse
@@ -10,24 +11,30 @@ from urllib.parse import parse_qs, urlparse
 import httpx
 import jwt
 import pytest
+from authlib.jose import JsonWebKey, JsonWebToken
 from cryptography.fernet import Fernet
 from cryptography.hazmat.primitives import serialization
 from cryptography.hazmat.primitives.asymmetric.ed25519 import Ed25519PrivateKey
+from fastapi import HTTPException
 from pytest_httpx import HTTPXMock
 
 from diracx.core.config import Config
-from diracx.core.exceptions import AuthorizationError
+from diracx.core.exceptions import AuthorizationError, InvalidCredentialsError
 from diracx.core.models import GrantType
 from diracx.core.properties import NORMAL_USER, PROXY_MANAGEMENT, SecurityProperty
 from diracx.core.settings import AuthSettings
-from diracx.logic.auth.token import create_token
+from diracx.logic.auth.token import create_token, exchange_token
 from diracx.logic.auth.utils import (
+    _jwk_set_cache,
     _server_metadata_cache,
     decrypt_state,
     encrypt_state,
+    fetch_jwk_set,
     get_server_metadata,
     parse_and_validate_scope,
+    parse_id_token,
 )
+from diracx.routers.utils import users
 
 DIRAC_CLIENT_ID = "myDIRACClientID"
 pytestmark = pytest.mark.enabled_dependencies(
@@ -58,7 +65,8 @@ async def auth_httpx_mock(httpx_mock: HTTPXMock, monkeypatch):
     # https://colin-b.github.io/pytest_httpx/#allow-to-register-a-response-for-more-than-one-request
     httpx_mock._options.can_send_already_matched_responses = True
 
-    server_metadata = await get_server_metadata(f"https://{path}")
+    async with httpx.AsyncClient() as c:
+        server_metadata = await get_server_metadata(f"https://{path}", c)
 
     id_tokens = ["user1", "user2"]
 
@@ -179,6 +187,7 @@ async def test_authorization_flow(test_client, auth_httpx_mock: HTTPXMock):
     )
     assert r.status_code == 307, r.text
     query_parameters = parse_qs(urlparse(r.headers["Location"]).query)
+    assert query_parameters["scope"] == ["openid profile"]
     redirect_uri = query_parameters["redirect_uri"][0]
     state = query_parameters["state"][0]
 
@@ -685,6 +694,111 @@ async def test_refresh_token_invalid(test_client, auth_httpx_mock: HTTPXMock):
     assert data["detail"] == "Invalid JWT: bad_signature: "
 
 
+async def test_fetch_jwk_set_cached(httpx_mock: HTTPXMock):
+    """Test that the JWK set is only fetched again when explicitly refreshed."""
+    data_dir = Path(__file__).parent.parent / "data"
+    path = "idp-server.invalid/.well-known/openid-configuration"
+    httpx_mock.add_response(url=f"https://{path}", text=(data_dir / path).read_text())
+    jwk = JsonWebKey.generate_key("EC", "P-256", is_private=True)
+    jwks_url = "https://idp-server.invalid/jwk"
+    httpx_mock.add_response(
+        url=jwks_url, json={"keys": [jwk.as_dict(is_private=False)]}, is_reusable=True
+    )
+    _server_metadata_cache.clear()
+    _jwk_set_cache.clear()
+
+    try:
+        async with httpx.AsyncClient() as c:
+            jwk_set = await fetch_jwk_set(f"https://{path}", c)
+            assert await fetch_jwk_set(f"https://{path}", c) is jwk_set
+            assert len(httpx_mock.get_requests(url=jwks_url)) == 1
+
+            assert (
+                await fetch_jwk_set(f"https://{path}", c, refresh=True) is not jwk_set
+            )
+            assert len(httpx_mock.get_requests(url=jwks_url)) == 2
+    finally:
+        _server_metadata_cache.clear()
+        _jwk_set_cache.clear()
+
+
+async def test_parse_id_token_key_rotation(httpx_mock: HTTPXMock):
+    """Test that the JWK set is fetched again if the token's key is unknown."""
+    data_dir = Path(__file__).parent.parent / "data"
+    path = "idp-server.invalid/.well-known/openid-configuration"
+    httpx_mock.add_response(url=f"https://{path}", text=(data_dir / path).read_text())
+    old_jwk = JsonWebKey.generate_key(
+        "EC", "P-256", is_private=True, options={"kid": "old"}
+    )
+    new_jwk = JsonWebKey.generate_key(
+        "EC", "P-256", is_private=True, options={"kid": "new"}
+    )
+    jwks_url = "https://idp-server.invalid/jwk"
+    # The IdP rotates its keys after the first fetch
+    httpx_mock.add_response(
+        url=jwks_url, json={"keys": [old_jwk.as_dict(is_private=False)]}
+    )
+    httpx_mock.add_response(
+        url=jwks_url,
+        json={"keys": [jwk.as_dict(is_private=False) for jwk in (old_jwk, new_jwk)]},
+    )
+    config = Config.model_validate(
+        {
+            "DIRAC": {},
+            "Registry": {
+                "lhcb": {
+                    "DefaultGroup": "lhcb_user",
+                    "IdP": {
+                        "URL": "https://idp-server.invalid",
+                        "ClientID": "test-idp",
+                    },
+                    "Users": {},
+                    "Groups": {
+                        "lhcb_user": {"Properties": ["NormalUser"], "Users": []}
+                    },
+                }
+            },
+            "Operations": {"Defaults": {}},
+        }
+    )
+    now = int(datetime.now(timezone.utc).timestamp())
+    claims = {
+        "iss": "https://idp-server.invalid/",
+        "aud": "test-idp",
+        "sub": "b824d4dc-1f9d-4ee8-8df5-c0ae55d46041",
+        "iat": now,
+        "exp": now + 60,
+    }
+    jwt_es256 = JsonWebToken(["ES256"])
+    _server_metadata_cache.clear()
+    _jwk_set_cache.clear()
+
+    try:
+        async with httpx.AsyncClient() as c:
+            await fetch_jwk_set(f"https://{path}", c)
+            assert len(httpx_mock.get_requests(url=jwks_url)) == 1
+
+            raw_id_token = jwt_es256.encode(
+                {"alg": "ES256", "kid": "new"}, claims, new_jwk
+            ).decode()
+            token = await parse_id_token(config, "lhcb", raw_id_token, c)
+            assert token["sub"] == claims["sub"]
+            assert len(httpx_mock.get_requests(url=jwks_url)) == 2
+
+            # Without a kid, the key can't be picked from the set and fetching
+            # it again wouldn't help
+            anonymous_jwk = JsonWebKey.generate_key("EC", "P-256", is_private=True)
+            raw_id_token = jwt_es256.encode(
+                {"alg": "ES256"}, claims, anonymous_jwk
+            ).decode()
+            with pytest.raises(ValueError):
+                await parse_id_token(config, "lhcb", raw_id_token, c)
+            assert len(httpx_mock.get_requests(url=jwks_url)) == 2
+    finally:
+        _server_metadata_cache.clear()
+        _jwk_set_cache.clear()
+
+
 async def test_bad_access_token(test_client):
     """Test accessing a resource with a bad token."""
     # From https://github.com/DIRACGrid/diracx/pull/496
@@ -699,6 +813,73 @@ async def test_bad_access_token(test_client):
     assert data["detail"] == "Invalid JWT"
 
 
+@pytest.mark.parametrize("authorization", ["Bearer ", "Basic abc", "bearer abc"])
+async def test_malformed_authorization_header(test_client, authorization):
+    """Test accessing a resource with a malformed Authorization header."""
+    r = test_client.get("/api/auth/userinfo", headers={"Authorization": authorization})
+    data = r.json()
+
+    assert r.status_code == 400, data
+    assert data["detail"] == "Invalid authorization header"
+
+
+async def test_access_token_cache(test_auth_settings, monkeypatch):
+    """Test that a valid access token is only decoded once while it is cached."""
+    users._token_cache.clear()
+    calls = []
+    read_token = users.read_token
+
+    def counting_read_token(*args, **kwargs):
+        calls.append(args)
+        return read_token(*args, **kwargs)
+
+    monkeypatch.setattr(users, "read_token", counting_read_token)
+
+    payload = {
+        "sub": "testingVO:yellow-sub",
+        "exp": datetime.now(tz=timezone.utc) + timedelta(minutes=5),
+        "iss": test_auth_settings.token_issuer,
+        "dirac_properties": [NORMAL_USER],
+        "jti": "0195b6f3-4d2b-7c1a-9b7e-0a1b2c3d4e5f",
+        "preferred_username": "preferred_username",
+        "dirac_group": "test_group",
+        "vo": "lhcb",
+    }
+    token = create_token(payload, test_auth_settings)
+
+    first = await users.verify_dirac_access_token(f"Bearer {token}", test_auth_settings)
+    second = await users.verify_dirac_access_token(
+        f"Bearer {token}", test_auth_settings
+    )
+    assert first == second
+    assert len(calls) == 1
+
+    # The requests don't share the cached object
+    first.properties.append("MutatedProperty")
+    first.policies["MutatedPolicy"] = {}
+    third = await users.verify_dirac_access_token(f"Bearer {token}", test_auth_settings)
+    assert third == second
+    assert "MutatedProperty" not in third.properties
+    assert len(calls) == 1
+
+    # Invalid tokens are never cached
+    for _ in range(2):
+        with pytest.raises(HTTPException):
+            await users.verify_dirac_access_token(
+                f"Bearer {token}x", test_auth_settings
+            )
+    assert len(calls) == 3
+    assert len(users._token_cache) == 1
+
+    # Once the token has expired, it is verified again (and rejected) even
+    # though the cache entry is still there
+    now = time.time()
+    monkeypatch.setattr(users.time, "time", lambda: now + 10 * 60)
+    with pytest.raises(HTTPException):
+        await users.verify_dirac_access_token(f"Bearer {token}", test_auth_settings)
+    assert len(calls) == 4
+
+
 async def test_list_refresh_tokens(test_client, auth_httpx_mock: HTTPXMock):
     """Test the refresh token listing with 2 users, a normal one and token manager:
     - normal user gets a refresh token and lists it
@@ -1126,6 +1307,35 @@ def test_parse_scopes_invalid(vos, groups, scope, expected_error):
         parse_and_validate_scope(scope, config, available_properties)
 
 
+async def test_exchange_token_unknown_user(test_auth_settings):
+    """Test that a subject which is not in the registry is rejected."""
+    config = Config.model_validate(
+        {
+            "DIRAC": {},
+            "Registry": {
+                "lhcb": {
+                    "DefaultGroup": "lhcb_user",
+                    "IdP": {"URL": "https://idp.invalid", "ClientID": "test-idp"},
+                    "Users": {},
+                    "Groups": {
+                        "lhcb_user": {"Properties": ["NormalUser"], "Users": []}
+                    },
+                }
+            },
+            "Operations": {"Defaults": {}},
+        }
+    )
+    with pytest.raises(InvalidCredentialsError, match="not registered"):
+        await exchange_token(
+            None,
+            "vo:lhcb",
+            {"sub": "unknown-sub", "preferred_username": "unknown"},
+            config,
+            test_auth_settings,
+            SecurityProperty.available_properties(),
+        )
+
+
 def test_encrypt_decrypt_state_valid_state(fernet_key):
     """Test that decrypt_state returns the correct state."""
     fernet = Fernet(fernet_key)
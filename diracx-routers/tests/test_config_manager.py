@@ -1,116 +1,222 @@
 from __future__ import annotations
 
+import asyncio
+from types import MappingProxyType
+
+import httpx
 import pytest
 from fastapi import status
 
-pytestmark = pytest.mark.enabled_dependencies(
-    ["AuthSettings", "ConfigSource", "OpenAccessPolicy"]
-)
+ENABLED_DEPENDENCIES = ["AuthSettings", "ConfigSource", "OpenAccessPolicy"]
+
+
+@pytest.fixture(scope="module")
+def module_client_factory(session_client_factory):
+    """Configure the app once for the whole module.
 
+    None of the tests here modify the state of the app, so the clients (and
+    the app startup that comes with them) can be shared between tests.
+    """
+    with session_client_factory.configure(enabled_dependencies=ENABLED_DEPENDENCIES):
+        yield session_client_factory
 
-@pytest.fixture
-def normal_user_client(client_factory):
-    with client_factory.normal_user() as client:
+
+@pytest.fixture(scope="module")
+def unauthenticated_client(module_client_factory):
+    with module_client_factory.unauthenticated() as client:
         yield client
 
 
-def test_unauthenticated(client_factory):
-    with client_factory.unauthenticated() as client:
-        response = client.get("/api/config/")
-        assert response.status_code == status.HTTP_401_UNAUTHORIZED
+@pytest.fixture(scope="module")
+def normal_user_client(module_client_factory):
+    with module_client_factory.normal_user() as client:
+        yield client
+
 
+def test_unauthenticated(unauthenticated_client):
+    response = unauthenticated_client.get("/api/config/")
+    assert response.status_code == status.HTTP_401_UNAUTHORIZED
 
-def test_get_config(normal_user_client):
+
+@pytest.fixture(scope="module")
+def config_validators(normal_user_client):
+    """Return the ETag and Last-Modified of the current config.
+
+    The config doesn't change during the tests, so it is only fetched once.
+    """
+    r = normal_user_client.head("/api/config/")
+    assert r.status_code == status.HTTP_200_OK, r.text
+    return r.headers["ETag"], r.headers["Last-Modified"]
+
+
+def test_get_config(normal_user_client, config_validators):
     r = normal_user_client.get("/api/config/")
-    assert r.status_code == status.HTTP_200_OK, r.json()
+    assert r.status_code == status.HTTP_200_OK, r.text
     assert r.json(), r.text
+    assert (r.headers["ETag"], r.headers["Last-Modified"]) == config_validators
+    assert r.headers["Cache-Control"] == "private, max-age=30"
 
-    last_modified = r.headers["Last-Modified"]
-    etag = r.headers["ETag"]
 
-    r = normal_user_client.get(
-        "/api/config/",
-        headers={
-            "If-None-Match": etag,
-            "If-Modified-Since": last_modified,
-        },
-    )
+def test_etag_is_config_revision(with_config_repo, config_validators):
+    """The ETag is the git revision of the config, the body is never hashed."""
+    from git import Repo
 
-    assert r.status_code == status.HTTP_304_NOT_MODIFIED, r.text
-    assert not r.text
+    etag, _ = config_validators
+    assert etag == Repo(with_config_repo).head.commit.hexsha
 
-    # If only an invalid ETAG is passed, we expect a response
-    r = normal_user_client.get(
-        "/api/config/",
-        headers={
-            "If-None-Match": "wrongEtag",
-        },
-    )
-    assert r.status_code == status.HTTP_200_OK, r.json()
-    assert r.json(), r.text
 
-    # If an past ETAG and an past timestamp as give, we expect an response
-    r = normal_user_client.get(
-        "/api/config/",
-        headers={
-            "If-None-Match": "pastEtag",
-            "If-Modified-Since": "Mon, 1 Apr 2000 00:42:42 GMT",
-        },
+def test_head_config(normal_user_client, config_validators):
+    etag, last_modified = config_validators
+    r = normal_user_client.head("/api/config/")
+    assert r.status_code == status.HTTP_200_OK, r.text
+    assert not r.content
+    # The headers describe the body that GET would return
+    assert r.headers.get("content-length") != "0"
+    assert (
+        r.headers["content-type"]
+        == normal_user_client.get("/api/config/").headers["content-type"]
     )
-    assert r.status_code == status.HTTP_200_OK, r.json()
-    assert r.json(), r.text
+    assert r.headers["ETag"] == etag
+    assert r.headers["Last-Modified"] == last_modified
+    assert r.headers["Cache-Control"] == "private, max-age=30"
 
-    # If an future ETAG and an new timestamp as give, we expect 304
-    r = normal_user_client.get(
-        "/api/config/",
-        headers={
-            "If-None-Match": "futureEtag",
-            "If-Modified-Since": "Mon, 1 Apr 9999 00:42:42 GMT",
-        },
-    )
+    r = normal_user_client.head("/api/config/", headers={"If-None-Match": etag})
     assert r.status_code == status.HTTP_304_NOT_MODIFIED, r.text
-    assert not r.text
 
+
+PAST_DATE = "Mon, 1 Apr 2000 00:42:42 GMT"
+FUTURE_DATE = "Mon, 1 Apr 9999 00:42:42 GMT"
+
+# The "{etag}" and "{last_modified}" placeholders are replaced by the
+# validators of the current config. The headers are read-only as they are
+# shared between the tests.
+CONDITIONAL_GET_CASES = (
+    pytest.param(
+        MappingProxyType(
+            {"If-None-Match": "{etag}", "If-Modified-Since": "{last_modified}"}
+        ),
+        status.HTTP_304_NOT_MODIFIED,
+        id="current-etag-current-date",
+    ),
+    # If only an invalid ETAG is passed, we expect a response
+    pytest.param(
+        MappingProxyType({"If-None-Match": "wrongEtag"}),
+        status.HTTP_200_OK,
+        id="wrong-etag",
+    ),
+    # If an past ETAG and an past timestamp as give, we expect an response
+    pytest.param(
+        MappingProxyType({"If-None-Match": "pastEtag", "If-Modified-Since": PAST_DATE}),
+        status.HTTP_200_OK,
+        id="past-etag-past-date",
+    ),
+    # If an future ETAG and an new timestamp as give, we expect 304
+    pytest.param(
+        MappingProxyType(
+            {"If-None-Match": "futureEtag", "If-Modified-Since": FUTURE_DATE}
+        ),
+        status.HTTP_304_NOT_MODIFIED,
+        id="future-etag-future-date",
+    ),
+    # The obsolete asctime date format is also understood
+    pytest.param(
+        MappingProxyType(
+            {
+                "If-None-Match": "futureEtag",
+                "If-Modified-Since": "Thu Apr  1 00:42:42 9999",
+            }
+        ),
+        status.HTTP_304_NOT_MODIFIED,
+        id="future-etag-future-asctime-date",
+    ),
     # If an invalid ETAG and an invalid modified time, we expect a response
-    r = normal_user_client.get(
-        "/api/config/",
-        headers={
-            "If-None-Match": "futureEtag",
-            "If-Modified-Since": "wrong format",
-        },
-    )
-    assert r.status_code == status.HTTP_200_OK, r.json()
-    assert r.json(), r.text
+    pytest.param(
+        MappingProxyType(
+            {"If-None-Match": "futureEtag", "If-Modified-Since": "wrong format"}
+        ),
+        status.HTTP_200_OK,
+        id="future-etag-invalid-date",
+    ),
+    # A date with out of range fields is ignored like an invalid one
+    pytest.param(
+        MappingProxyType(
+            {
+                "If-None-Match": "futureEtag",
+                "If-Modified-Since": "Mon, 1 Apr 99999999999999999999 00:42:42 GMT",
+            }
+        ),
+        status.HTTP_200_OK,
+        id="future-etag-overflowing-date",
+    ),
+)
+
+
+def _format_headers(headers, config_validators):
+    etag, last_modified = config_validators
+    return {
+        k: v.format(etag=etag, last_modified=last_modified) for k, v in headers.items()
+    }
 
-    # If the correct ETAG and a past timestamp as give, we expect 304
-    r = normal_user_client.get(
-        "/api/config/",
-        headers={
-            "If-None-Match": etag,
-            "If-Modified-Since": "Mon, 1 Apr 2000 00:42:42 GMT",
-        },
-    )
-    assert r.status_code == status.HTTP_304_NOT_MODIFIED, r.text
-    assert not r.text
 
-    # If the correct ETAG and a new timestamp as give, we expect 304
+def _check_conditional_response(r, expected_status):
+    assert r.status_code == expected_status, r.text
+    assert r.headers["Cache-Control"] == "private, max-age=30"
+    if expected_status == status.HTTP_304_NOT_MODIFIED:
+        assert not r.text
+    else:
+        assert r.json(), r.text
+
+
+@pytest.mark.parametrize("headers, expected_status", CONDITIONAL_GET_CASES)
+def test_conditional_get_config(
+    normal_user_client, config_validators, headers, expected_status
+):
     r = normal_user_client.get(
-        "/api/config/",
-        headers={
-            "If-None-Match": etag,
-            "If-Modified-Since": "Mon, 1 Apr 9999 00:42:42 GMT",
-        },
+        "/api/config/", headers=_format_headers(headers, config_validators)
     )
-    assert r.status_code == status.HTTP_304_NOT_MODIFIED, r.text
-    assert not r.text
+    _check_conditional_response(r, expected_status)
 
-    # If the correct ETAG and an invalid modified time, we expect 304
-    r = normal_user_client.get(
+
+# A matching ETag takes precedence over If-Modified-Since, whatever its value
+@pytest.mark.parametrize(
+    "if_modified_since",
+    [
+        pytest.param(PAST_DATE, id="past-date"),
+        pytest.param(FUTURE_DATE, id="future-date"),
+        pytest.param("wrong format", id="invalid-date"),
+    ],
+)
+def test_etag_match_wins(normal_user_client, config_validators, if_modified_since):
+    etag, _ = config_validators
+    # Only the status and headers matter, so don't read the body
+    with normal_user_client.stream(
+        "GET",
         "/api/config/",
-        headers={
-            "If-None-Match": etag,
-            "If-Modified-Since": "wrong format",
-        },
-    )
-    assert r.status_code == status.HTTP_304_NOT_MODIFIED, r.text
-    assert not r.text
+        headers={"If-None-Match": etag, "If-Modified-Since": if_modified_since},
+    ) as r:
+        assert r.status_code == status.HTTP_304_NOT_MODIFIED
+        assert r.headers["ETag"] == etag
+        assert r.headers["Cache-Control"] == "private, max-age=30"
+
+
+async def test_concurrent_conditional_get_config(normal_user_client, config_validators):
+    """Send all the conditional requests at once through the ASGI app."""
+    # ASGITransport doesn't run the lifespan of the app, this is taken care of
+    # by the normal_user_client which also provides the authorization header
+    async with httpx.AsyncClient(
+        transport=httpx.ASGITransport(app=normal_user_client.app),
+        base_url=str(normal_user_client.base_url),
+        headers=normal_user_client.headers,
+    ) as client:
+        responses = await asyncio.gather(
+            *(
+                client.get(
+                    "/api/config/",
+                    headers=_format_headers(case.values[0], config_validators),
+                )
+                for case in CONDITIONAL_GET_CASES
+            )
+        )
+
+    for case, r in zip(CONDITIONAL_GET_CASES, responses, strict=True):
+        _check_conditional_response(r, case.values[1])
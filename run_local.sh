@@ -7,8 +7,8 @@ tmp_dir=$(mktemp -d)
 echo "Using temp dir: ${tmp_dir}"
 mkdir -p "${tmp_dir}/signing-key" "${tmp_dir}/cs_store/"
 
-signing_key="${tmp_dir}/signing-key/rsa256.key"
-ssh-keygen -P "" -t rsa -b 4096 -m PEM -f "${signing_key}"
+signing_key="${tmp_dir}/signing-key/ed25519.key"
+openssl genpkey -algorithm ed25519 -out "${signing_key}"
 
 state_key="$(head -c 32 /dev/urandom | base64)"
 